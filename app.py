@@ -1,17 +1,30 @@
 import json
+import hashlib
 import io
-from flask import Flask, g, jsonify, request, send_file, render_template, make_response, redirect, url_for, session
+from flask import Flask, g, jsonify, request, send_file, render_template, make_response, redirect, url_for, session, Response, stream_with_context
 import os
+import re
 from io import BytesIO
 from fpdf import FPDF
-from datetime import datetime
+from fpdf.fonts import FontFace
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
 from urllib.parse import urlparse
 import logging
 import sys
-from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import time
+import zlib
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from flask_caching import Cache
+from flask_compress import Compress
+from flask.json.provider import DefaultJSONProvider
+import orjson
 from functools import wraps
 
 # Configure logging
@@ -36,12 +49,39 @@ if DATABASE_URL.startswith("postgres://"):
 
 logger.info("Starting Invoice Manager Application")
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes responses with orjson"""
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__, static_folder="static", template_folder="templates")
+app.json = ORJSONProvider(app)
 app.config["JSON_SORT_KEYS"] = False
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max request size
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key-change-in-production-12345")
 app.config["SESSION_COOKIE_HTTPONLY"] = True
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+app.config["CACHE_TYPE"] = os.environ.get("CACHE_TYPE", "SimpleCache")
+app.config["CACHE_DEFAULT_TIMEOUT"] = 60
+
+# Compress JSON responses (PDFs are skipped: fpdf2 already deflates page streams).
+# Streamed responses are excluded because Flask-Compress buffers the whole body to
+# compress it; list_invoices gzips its own stream incrementally instead.
+app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+app.config["COMPRESS_LEVEL"] = 6
+app.config["COMPRESS_STREAMS"] = False
+
+# Initialize Flask-Caching
+cache = Cache(app)
+
+# Initialize Flask-Compress
+Compress(app)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -58,38 +98,188 @@ class User(UserMixin):
         self.company_name = company_name
         self.phone_number = phone_number
 
+    def to_dict(self):
+        """Plain-dict form of the user, suitable for the session cookie"""
+        return {
+            "id": self.id,
+            "username": self.username,
+            "email": self.email,
+            "full_name": self.full_name,
+            "company_name": self.company_name,
+            "phone_number": self.phone_number
+        }
+
+# argon2id tuned for ~30ms per hash (vs. ~100ms for Werkzeug's default pbkdf2)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19_456, parallelism=1)
+
+def hash_password(password):
+    """Hash a password with argon2id"""
+    return password_hasher.hash(password)
+
+def verify_password(password_hash, password):
+    """Check a password against an argon2 or legacy Werkzeug hash, returning (valid, needs_rehash)"""
+    if password_hash.startswith("$argon2"):
+        try:
+            password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, password_hasher.check_needs_rehash(password_hash)
+    return check_password_hash(password_hash, password), True
+
+# Seconds a session-cached profile is trusted before the user row is checked again,
+# so deleted users lose their session within this window
+SESSION_PROFILE_MAX_AGE = 300
+
+@cache.memoize(timeout=60)
+def _fetch_user_row(user_id):
+    """Fetch a user row as a plain dict (memoized; invalidate with cache.delete_memoized)"""
+    db = get_db()
+    cur = db.cursor()
+    execute_prepared(cur, "load_user_q", (user_id,))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
 @login_manager.user_loader
 def load_user(user_id):
     """Load user from database for Flask-Login"""
+    # The signed session cookie carries the profile stored at login, so most requests skip
+    # the DB; it is re-checked against the users table once it is older than SESSION_PROFILE_MAX_AGE
+    profile = session.get("user_profile")
+    if (profile and str(profile.get("id")) == str(user_id)
+            and time.time() - session.get("user_profile_at", 0) < SESSION_PROFILE_MAX_AGE):
+        return User(**profile)
     try:
-        db = get_db()
-        cur = db.cursor()
-        cur.execute("SELECT id, username, email, full_name, company_name, phone_number FROM users WHERE id=%s", (user_id,))
-        row = cur.fetchone()
+        row = _fetch_user_row(int(user_id))
         if row:
-            return User(row["id"], row["username"], row["email"], row["full_name"], row["company_name"], row["phone_number"])
+            user = User(**row)
+            remember_user_profile(user)
+            return user
+        session.pop("user_profile", None)
+        session.pop("user_profile_at", None)
     except Exception as e:
         logger.error(f"Error loading user: {e}")
     return None
 
+def remember_user_profile(user):
+    """Store the user's profile in the session along with when it was read"""
+    session["user_profile"] = user.to_dict()
+    session["user_profile_at"] = time.time()
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which prepared statements exist on its session"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+# Hot queries prepared once per connection so PostgreSQL skips parse/plan on reuse
+PREPARED_STATEMENTS = {
+    "load_user_q": "SELECT id, username, email, full_name, company_name, phone_number FROM users WHERE id=$1",
+    "max_invoice_number_q": "SELECT MAX(invoice_number) as mx FROM invoices WHERE user_id=$1",
+    "invoice_stamp_q": "SELECT MAX(id) as max_id, COUNT(*) as n, MAX(updated_at) as updated FROM invoices WHERE user_id=$1",
+    "invoice_id_by_number_q": "SELECT id FROM invoices WHERE invoice_number=$1 AND user_id=$2",
+}
+
+# Off by default: transaction-mode poolers (PgBouncer behind Vercel Postgres, Neon and
+# Supabase pooled URLs) do not keep prepared statements between transactions. Set
+# DB_PREPARED_STATEMENTS=1 only for direct, non-pooled connections.
+USE_PREPARED_STATEMENTS = os.environ.get("DB_PREPARED_STATEMENTS") == "1"
+
+def execute_prepared(cur, name, params):
+    """Execute a statement from PREPARED_STATEMENTS, preparing it on first use per connection"""
+    if not USE_PREPARED_STATEMENTS:
+        cur.execute(re.sub(r"\$\d+", "%s", PREPARED_STATEMENTS[name]), params)
+        return
+    conn = cur.connection
+    if name not in conn.prepared:
+        cur.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        conn.prepared.add(name)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+# Serverless instances handle one request at a time
+DB_POOL_MAX = 1 if os.environ.get("VERCEL") else 20
+# Connections idle longer than this (seconds) are pinged before reuse, since
+# serverless Postgres (Neon / Vercel Postgres) drops them when compute suspends
+DB_POOL_PING_AFTER = 30
+
+# Process-wide connection pool, created on first use so it survives warm invocations
+db_pool = None
+db_pool_lock = threading.Lock()
+# Bounds checkouts so callers wait for a free connection instead of getting PoolError
+db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+def get_pool():
+    """Get (or lazily create) the database connection pool"""
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                if os.environ.get("VERCEL"):
+                    db_pool = psycopg2.pool.SimpleConnectionPool(1, DB_POOL_MAX, dsn=DATABASE_URL, connection_factory=PreparingConnection,
+                                                                 cursor_factory=RealDictCursor)
+                else:
+                    db_pool = psycopg2.pool.ThreadedConnectionPool(2, DB_POOL_MAX, dsn=DATABASE_URL, connection_factory=PreparingConnection,
+                                                                   cursor_factory=RealDictCursor)
+                logger.info("Database connection pool created")
+    return db_pool
+
+def checkout_connection():
+    """Take a live connection from the pool, replacing any the server has dropped"""
+    pool = get_pool()
+    while True:
+        conn = pool.getconn()
+        if not conn.closed and time.monotonic() - conn.last_used <= DB_POOL_PING_AFTER:
+            return conn
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connection already closed")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Freshly opened connections skip the ping, so this ends once idle ones are drained
+            logger.warning(f"Discarding stale database connection: {e}")
+            pool.putconn(conn, close=True)
+
 def get_db():
     """Get database connection from application context"""
     db = getattr(g, "_database", None)
     if db is None:
+        db_pool_slots.acquire()
         try:
-            db = g._database = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-            logger.debug("Database connection established")
+            db = g._database = checkout_connection()
+            logger.debug("Database connection acquired from pool")
         except Exception as e:
+            db_pool_slots.release()
             logger.error(f"Failed to connect to database: {e}")
             raise
     return db
 
-def init_db():
+def schema_is_current(cur):
+    """Cheap single-query check that the latest schema objects already exist"""
+    cur.execute("""
+    SELECT to_regclass('public.items') IS NOT NULL
+       AND to_regclass('public.idx_items_customer_id') IS NOT NULL
+       AND EXISTS (SELECT 1 FROM pg_constraint WHERE conname='invoices_user_id_invoice_number_key')
+       AND EXISTS (SELECT 1 FROM pg_trigger WHERE tgname='invoices_touch_updated_at')
+       AS ready;
+    """)
+    row = cur.fetchone()
+    return bool(row and row["ready"])
+
+def init_db(force=False):
     """Initialize database tables if they don't exist"""
     try:
         db = get_db()
         cur = db.cursor()
 
+        # Skip the full migration on warm databases unless explicitly requested
+        if not force and schema_is_current(cur):
+            db.rollback()
+            logger.info("Database schema is up to date, skipping initialization")
+            return
+
         # users table
         cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -186,6 +376,28 @@ def init_db():
         );
         """)
 
+        # Indexes for the hot lookup paths (PostgreSQL does not index foreign keys automatically)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_user_date ON invoices(user_id, creation_date DESC);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_customers_invoice_id ON customers(invoice_id);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_items_customer_id ON items(customer_id);")
+
+        # Migration: updated_at row version for invoices, maintained by trigger
+        # (every write path to customers/items also updates the invoice row)
+        cur.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;")
+        cur.execute("""
+        CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = clock_timestamp();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS invoices_touch_updated_at ON invoices;")
+        cur.execute("""
+        CREATE TRIGGER invoices_touch_updated_at BEFORE UPDATE ON invoices
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+        """)
+
         db.commit()
         logger.info("Database tables initialized successfully")
     except Exception as e:
@@ -194,22 +406,139 @@ def init_db():
 
 @app.teardown_appcontext
 def close_connection(exception):
-    """Close database connection at the end of request"""
-    db = getattr(g, "_database", None)
-    if db is not None:
-        db.close()
-        logger.debug("Database connection closed")
+    """Return database connection to the pool at the end of request"""
+    db = g.pop("_database", None)
+    if db is None:
+        return
+    broken = bool(db.closed) or isinstance(exception, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    if not broken:
+        status = db.info.transaction_status
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            broken = True
+        elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Roll back here so a failure marks the connection broken instead of raising inside putconn
+            try:
+                db.rollback()
+            except psycopg2.Error as e:
+                logger.warning(f"Rollback failed, discarding connection: {e}")
+                broken = True
+    try:
+        db.last_used = time.monotonic()
+        get_pool().putconn(db, close=broken)
+        logger.debug("Database connection returned to pool")
+    except Exception as e:
+        logger.error(f"Failed to return database connection to pool: {e}")
+    finally:
+        db_pool_slots.release()
+
+# Invoice columns in output order; hot paths SELECT exactly these and zip plain tuples
+INVOICE_COLUMNS = ("id", "invoice_number", "creation_date", "company_name", "company_address", "company_email", "total_amount")
+INVOICE_SELECT = ", ".join(INVOICE_COLUMNS)
 
 def row_to_invoice(row):
-    """Convert database row to invoice dictionary"""
+    """Convert database row (dict-like or a tuple in INVOICE_COLUMNS order) to invoice dictionary"""
+    if isinstance(row, tuple):
+        return dict(zip(INVOICE_COLUMNS, row))
+    return {col: row[col] for col in INVOICE_COLUMNS}
+
+def attach_customers(db, invoices):
+    """Attach customers and their items to invoice dictionaries (3 queries total)"""
+    for inv in invoices:
+        inv["customers"] = []
+    if not invoices:
+        return invoices
+
+    # Plain tuple cursor: rows are unpacked directly instead of building a dict per row
+    cur = db.cursor(cursor_factory=psycopg2.extensions.cursor)
+    invoices_by_id = {inv["id"]: inv for inv in invoices}
+    cur.execute("SELECT id, invoice_id, name, address, email FROM customers WHERE invoice_id IN %s ORDER BY id",
+                (tuple(invoices_by_id),))
+    customers_by_id = {}
+    for cust_id, invoice_id, name, address, email in cur:
+        cust = {
+            "name": name,
+            "address": address,
+            "email": email,
+            "items": []
+        }
+        customers_by_id[cust_id] = cust
+        invoices_by_id[invoice_id]["customers"].append(cust)
+
+    if customers_by_id:
+        cur.execute("SELECT customer_id, description, quantity, unit_price FROM items WHERE customer_id IN %s ORDER BY id",
+                    (tuple(customers_by_id),))
+        for customer_id, description, quantity, unit_price in cur:
+            customers_by_id[customer_id]["items"].append({
+                "description": description,
+                "quantity": quantity,
+                "unit_price": unit_price
+            })
+    cur.close()
+    return invoices
+
+def insert_customers(cur, invoice_id, customers):
+    """Bulk insert customers and their items (2 statements total); returns them as stored"""
+    stored = [
+        {
+            "name": c.get("name"),
+            "address": c.get("address"),
+            "email": c.get("email"),
+            "items": [
+                {
+                    "description": it.get("description"),
+                    "quantity": int(it.get("quantity", 1)),
+                    "unit_price": float(it.get("unit_price", 0))
+                }
+                for it in c.get("items", [])
+            ]
+        }
+        for c in customers
+    ]
+    if not stored:
+        return stored
+    customer_ids = execute_values(
+        cur,
+        "INSERT INTO customers (invoice_id, name, address, email) VALUES %s RETURNING id",
+        [(invoice_id, c["name"], c["address"], c["email"]) for c in stored],
+        page_size=500,
+        fetch=True
+    )
+    item_rows = [
+        (row["id"], it["description"], it["quantity"], it["unit_price"])
+        for row, c in zip(customer_ids, stored)
+        for it in c["items"]
+    ]
+    if item_rows:
+        execute_values(
+            cur,
+            "INSERT INTO items (customer_id, description, quantity, unit_price) VALUES %s",
+            item_rows,
+            page_size=500
+        )
+    return stored
+
+def update_invoice_total(cur, invoice_id):
+    """Recompute an invoice's total_amount from its items and return it"""
+    cur.execute("""
+    UPDATE invoices SET total_amount = (
+        SELECT COALESCE(SUM(it.quantity * it.unit_price), 0)
+        FROM items it JOIN customers c ON c.id = it.customer_id
+        WHERE c.invoice_id = %s
+    ) WHERE id = %s RETURNING total_amount
+    """, (invoice_id, invoice_id))
+    return cur.fetchone()["total_amount"]
+
+def build_invoice_response(invoice_id, invoice_number, data, total_amount, customers):
+    """Build an invoice dictionary from a write request without re-reading it"""
     return {
-        "id": row["id"],
-        "invoice_number": row["invoice_number"],
-        "creation_date": row["creation_date"],
-        "company_name": row["company_name"],
-        "company_address": row["company_address"],
-        "company_email": row["company_email"],
-        "total_amount": row["total_amount"]
+        "id": invoice_id,
+        "invoice_number": invoice_number,
+        "creation_date": data.get("creation_date"),
+        "company_name": data.get("company_name"),
+        "company_address": data.get("company_address"),
+        "company_email": data.get("company_email"),
+        "total_amount": total_amount,
+        "customers": customers
     }
 
 # ============ Error Handlers ============
@@ -266,26 +595,23 @@ def register():
 
         # Check if user already exists
         db = get_db()
-        cur = db.cursor()
-        cur.execute("SELECT id FROM users WHERE username=%s OR email=%s", (username, email))
-        if cur.fetchone():
-            return jsonify({"error": "Username or email already exists"}), 400
-
-        # Hash password and create user
-        password_hash = generate_password_hash(password)
-        cur.execute(
-            "INSERT INTO users (username, email, password_hash, full_name, company_name, phone_number) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
-            (username, email, password_hash, full_name, company_name, phone_number)
-        )
-        user_id = cur.fetchone()["id"]
-        db.commit()
+        with db, db.cursor() as cur:
+            cur.execute("SELECT id FROM users WHERE username=%s OR email=%s", (username, email))
+            if cur.fetchone():
+                return jsonify({"error": "Username or email already exists"}), 400
+
+            # Hash password and create user
+            password_hash = hash_password(password)
+            cur.execute(
+                "INSERT INTO users (username, email, password_hash, full_name, company_name, phone_number) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
+                (username, email, password_hash, full_name, company_name, phone_number)
+            )
+            user_id = cur.fetchone()["id"]
 
         logger.info(f"New user registered: {username}")
         return jsonify({"success": True, "message": "Registration successful"}), 201
     except Exception as e:
         logger.error(f"Error registering user: {e}")
-        if 'db' in locals():
-            db.rollback()
         return jsonify({"error": "Failed to register user"}), 500
 
 @app.route("/api/auth/login", methods=["POST"])
@@ -308,12 +634,21 @@ def login():
         cur.execute("SELECT id, username, email, password_hash, full_name, company_name, phone_number FROM users WHERE username=%s", (username,))
         row = cur.fetchone()
 
-        if not row or not check_password_hash(row["password_hash"], password):
+        if not row:
+            return jsonify({"error": "Invalid username or password"}), 401
+        valid, needs_rehash = verify_password(row["password_hash"], password)
+        if not valid:
             return jsonify({"error": "Invalid username or password"}), 401
 
+        # Upgrade legacy pbkdf2 (or outdated argon2) hashes now that we know the password
+        if needs_rehash:
+            with db, db.cursor() as upd:
+                upd.execute("UPDATE users SET password_hash=%s WHERE id=%s", (hash_password(password), row["id"]))
+
         # Create user object and login
         user = User(row["id"], row["username"], row["email"], row["full_name"], row["company_name"], row["phone_number"])
         login_user(user)
+        remember_user_profile(user)
 
         logger.info(f"User logged in: {username}")
         return jsonify({
@@ -336,6 +671,8 @@ def logout():
     """Logout user"""
     username = current_user.username
     logout_user()
+    session.pop("user_profile", None)
+    session.pop("user_profile_at", None)
     logger.info(f"User logged out: {username}")
     return jsonify({"success": True, "message": "Logged out successfully"}), 200
 
@@ -368,38 +705,76 @@ def simple_test():
     """Simple click test page"""
     return render_template("simple-test.html")
 
+def gzip_stream(chunks):
+    """Gzip an iterable of str chunks incrementally, flushing after each chunk"""
+    compressor = zlib.compressobj(app.config["COMPRESS_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+# Number of invoices fetched per round-trip when streaming the invoice list
+LIST_INVOICES_PAGE_SIZE = 500
+
 @app.route("/api/invoices", methods=["GET"])
 @login_required
 def list_invoices():
     """List all invoices with their customers and items for the current user"""
+    def fetch_page():
+        """Fetch the next page of invoices as serialized JSON objects"""
+        rows = cur.fetchmany(cur.itersize)
+        return [app.json.dumps(inv) for inv in attach_customers(db, [row_to_invoice(r) for r in rows])]
+
+    def close_cursor():
+        try:
+            cur.close()
+        except psycopg2.Error:
+            pass
+
     try:
         db = get_db()
-        cur = db.cursor()
-        cur.execute("SELECT * FROM invoices WHERE user_id=%s ORDER BY creation_date DESC", (current_user.id,))
-        invoices = [row_to_invoice(dict(r)) for r in cur.fetchall()]
-
-        # Attach customers and items
-        for inv in invoices:
-            cur.execute("SELECT * FROM customers WHERE invoice_id=%s", (inv["id"],))
-            customers = []
-            for c in cur.fetchall():
-                c_dict = dict(c)
-                cur.execute("SELECT description, quantity, unit_price FROM items WHERE customer_id=%s", (c_dict["id"],))
-                items = [dict(x) for x in cur.fetchall()]
-                customers.append({
-                    "name": c_dict["name"],
-                    "address": c_dict["address"],
-                    "email": c_dict["email"],
-                    "items": items
-                })
-            inv["customers"] = customers
-
-        logger.info(f"Retrieved {len(invoices)} invoices")
-        return jsonify(invoices)
+        # Named (server-side) cursor so only one page of invoices is held in memory at a time
+        cur = db.cursor(name="list_invoices_cur", cursor_factory=psycopg2.extensions.cursor)
+        cur.itersize = LIST_INVOICES_PAGE_SIZE
+        cur.execute(f"SELECT {INVOICE_SELECT} FROM invoices WHERE user_id=%s ORDER BY creation_date DESC", (current_user.id,))
+        # Serialize the first page before committing to a 200, so query failures still get a JSON 500
+        first_page = fetch_page()
     except Exception as e:
         logger.error(f"Error listing invoices: {e}")
         return jsonify({"error": "Failed to retrieve invoices"}), 500
 
+    # Everything fit in one page: send a regular, fully-formed response
+    if len(first_page) < cur.itersize:
+        close_cursor()
+        logger.info(f"Retrieved {len(first_page)} invoices")
+        return Response("[" + ",".join(first_page) + "]", mimetype="application/json")
+
+    def generate():
+        count = len(first_page)
+        try:
+            yield "[" + ",".join(first_page)
+            while True:
+                page = fetch_page()
+                if not page:
+                    break
+                yield "," + ",".join(page)
+                count += len(page)
+            yield "]"
+            logger.info(f"Retrieved {count} invoices")
+        except Exception as e:
+            # Headers are already sent; re-raise so the server aborts the connection and the
+            # client sees an incomplete response rather than a clean 200 with truncated JSON
+            logger.error(f"Error streaming invoices after {count} rows: {e}")
+            raise
+        finally:
+            close_cursor()
+
+    if request.accept_encodings["gzip"]:
+        response = Response(stream_with_context(gzip_stream(generate())), mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
 @app.route("/api/invoices", methods=["POST"])
 @login_required
 def create_invoice():
@@ -412,48 +787,36 @@ def create_invoice():
 
         logger.info(f"Creating invoice for user {current_user.id}: {current_user.username}")
         db = get_db()
-        cur = db.cursor()
-
-        # Determine invoice number (per user)
-        invoice_number = data.get("invoice_number")
-        if not invoice_number:
-            cur.execute("SELECT MAX(invoice_number) as mx FROM invoices WHERE user_id=%s", (current_user.id,))
-            result = cur.fetchone()
-            mx = result["mx"] if result and result["mx"] else 999
-            invoice_number = mx + 1
+        # Single transaction: committed on success, rolled back on any exception
+        with db, db.cursor() as cur:
+            # Determine invoice number (per user)
+            invoice_number = data.get("invoice_number")
+            if not invoice_number:
+                execute_prepared(cur, "max_invoice_number_q", (current_user.id,))
+                result = cur.fetchone()
+                mx = result["mx"] if result and result["mx"] else 999
+                invoice_number = mx + 1
+
+            logger.info(f"Generated invoice number: {invoice_number}")
+
+            # Create invoice
+            cur.execute(
+                "INSERT INTO invoices (invoice_number, creation_date, company_name, company_address, company_email, total_amount, user_id) VALUES (%s, %s, %s, %s, %s, 0, %s) RETURNING id",
+                (invoice_number, data.get("creation_date"), data.get("company_name"), data.get("company_address"), data.get("company_email"), current_user.id)
+            )
+            invoice_id = cur.fetchone()["id"]
+            logger.info(f"Created invoice with ID: {invoice_id}")
+
+            # Add customers and items, then total them server-side
+            customers = insert_customers(cur, invoice_id, data.get("customers", []))
+            total_amount = update_invoice_total(cur, invoice_id)
 
-        logger.info(f"Generated invoice number: {invoice_number}")
-
-        # Validate and parse total amount
-        try:
-            total_amount = float(data.get("total_amount", 0))
-        except (ValueError, TypeError):
-            total_amount = 0.0
-
-        # Create invoice
-        cur.execute(
-            "INSERT INTO invoices (invoice_number, creation_date, company_name, company_address, company_email, total_amount, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
-            (invoice_number, data.get("creation_date"), data.get("company_name"), data.get("company_address"), data.get("company_email"), total_amount, current_user.id)
-        )
-        invoice_id = cur.fetchone()["id"]
-        logger.info(f"Created invoice with ID: {invoice_id}")
-
-        # Add customers and items
-        for c in data.get("customers", []):
-            cur.execute("INSERT INTO customers (invoice_id, name, address, email) VALUES (%s, %s, %s, %s) RETURNING id",
-                        (invoice_id, c.get("name"), c.get("address"), c.get("email")))
-            customer_id = cur.fetchone()["id"]
-            for it in c.get("items", []):
-                cur.execute("INSERT INTO items (customer_id, description, quantity, unit_price) VALUES (%s, %s, %s, %s)",
-                            (customer_id, it.get("description"), int(it.get("quantity", 1)), float(it.get("unit_price", 0))))
-
-        db.commit()
         logger.info(f"Created invoice #{invoice_number}")
-        return jsonify({"success": True, "invoice_number": invoice_number}), 201
+        # Echo the stored invoice so the client doesn't need a follow-up GET
+        invoice = build_invoice_response(invoice_id, invoice_number, data, total_amount, customers)
+        return jsonify({"success": True, "invoice_number": invoice_number, "invoice": invoice}), 201
     except Exception as e:
         logger.error(f"Error creating invoice: {e}")
-        if 'db' in locals():
-            db.rollback()
         return jsonify({"error": "Failed to create invoice"}), 500
 
 @app.route("/api/invoices/<int:invoice_number>", methods=["PUT"])
@@ -464,87 +827,88 @@ def modify_invoice(invoice_number):
         return jsonify({"error":"No JSON body"}), 400
 
     db = get_db()
-    cur = db.cursor()
-    cur.execute("SELECT id FROM invoices WHERE invoice_number=%s AND user_id=%s", (invoice_number, current_user.id))
-    row = cur.fetchone()
-    if not row:
-        return jsonify({"error":"Invoice not found"}), 404
-    inv_id = row["id"]
-    
-    # Update invoice header
-    cur.execute("UPDATE invoices SET creation_date=%s, company_name=%s, company_address=%s, company_email=%s, total_amount=%s WHERE id=%s",
-                (data.get("creation_date"), data.get("company_name"), data.get("company_address"), data.get("company_email"), float(data.get("total_amount",0)), inv_id))
-    
-    # Delete existing customers/items
-    cur.execute("SELECT id FROM customers WHERE invoice_id=%s", (inv_id,))
-    custs = [r["id"] for r in cur.fetchall()]
-    for cid in custs:
-        cur.execute("DELETE FROM items WHERE customer_id=%s", (cid,))
-    cur.execute("DELETE FROM customers WHERE invoice_id=%s", (inv_id,))
-    
-    # Insert new customers/items
-    for c in data.get("customers", []):
-        cur.execute("INSERT INTO customers (invoice_id, name, address, email) VALUES (%s, %s, %s, %s) RETURNING id",
-                    (inv_id, c.get("name"), c.get("address"), c.get("email")))
-        cid = cur.fetchone()["id"]
-        for it in c.get("items", []):
-            cur.execute("INSERT INTO items (customer_id, description, quantity, unit_price) VALUES (%s, %s, %s, %s)",
-                        (cid, it.get("description"), int(it.get("quantity",1)), float(it.get("unit_price",0))))
-    db.commit()
-    return jsonify({"success": True})
+    with db, db.cursor() as cur:
+        execute_prepared(cur, "invoice_id_by_number_q", (invoice_number, current_user.id))
+        row = cur.fetchone()
+        if not row:
+            return jsonify({"error":"Invoice not found"}), 404
+        inv_id = row["id"]
+
+        # Update invoice header
+        cur.execute("UPDATE invoices SET creation_date=%s, company_name=%s, company_address=%s, company_email=%s WHERE id=%s",
+                    (data.get("creation_date"), data.get("company_name"), data.get("company_address"), data.get("company_email"), inv_id))
+
+        # Delete existing customers (items are removed by ON DELETE CASCADE)
+        cur.execute("DELETE FROM customers WHERE invoice_id=%s", (inv_id,))
+
+        # Insert new customers/items
+        customers = insert_customers(cur, inv_id, data.get("customers", []))
+        total_amount = update_invoice_total(cur, inv_id)
+    invoice = build_invoice_response(inv_id, invoice_number, data, total_amount, customers)
+    return jsonify({"success": True, "invoice_number": invoice_number, "invoice": invoice})
 
 @app.route("/api/invoices/<int:invoice_number>", methods=["DELETE"])
 @login_required
 def delete_invoice(invoice_number):
     db = get_db()
-    cur = db.cursor()
-    cur.execute("SELECT id FROM invoices WHERE invoice_number=%s AND user_id=%s", (invoice_number, current_user.id))
-    row = cur.fetchone()
-    if not row:
+    with db, db.cursor() as cur:
+        # delete invoice (customers and items are removed by ON DELETE CASCADE)
+        cur.execute("DELETE FROM invoices WHERE invoice_number=%s AND user_id=%s RETURNING id", (invoice_number, current_user.id))
+        deleted = cur.fetchone()
+    if not deleted:
         return jsonify({"error":"Invoice not found"}), 404
-    inv_id = row["id"]
-    
-    # delete items, customers, invoice
-    cur.execute("SELECT id FROM customers WHERE invoice_id=%s", (inv_id,))
-    custs = [r["id"] for r in cur.fetchall()]
-    for cid in custs:
-        cur.execute("DELETE FROM items WHERE customer_id=%s", (cid,))
-    cur.execute("DELETE FROM customers WHERE invoice_id=%s", (inv_id,))
-    cur.execute("DELETE FROM invoices WHERE id=%s", (inv_id,))
-    db.commit()
     return jsonify({"success": True})
 
+# Length of the YYYY-MM-DD prefix that identifies each period bucket
+CATEGORIZE_PERIODS = {"day": 10, "month": 7, "year": 4}
+
+@cache.memoize(timeout=300)
+def _categorize_invoices(user_id, period, stamp):
+    """Group a user's invoices by period (memoized per user, period and invoice stamp)"""
+    db = get_db()
+    cur = db.cursor()
+    # Bucket and aggregate in one query: YYYY-MM-DD dates are grouped by their
+    # year/month/day prefix, anything else is kept as-is
+    cur.execute("""
+    SELECT bucket, json_agg(json_build_object(
+               'id', i.id,
+               'invoice_number', i.invoice_number,
+               'creation_date', i.creation_date,
+               'company_name', i.company_name,
+               'company_address', i.company_address,
+               'company_email', i.company_email,
+               'total_amount', i.total_amount,
+               'customers', COALESCE((SELECT json_agg(json_build_object('name', c.name) ORDER BY c.id)
+                                      FROM customers c WHERE c.invoice_id = i.id), '[]'::json)
+           ) ORDER BY i.creation_date DESC, i.id) AS invoices
+    FROM (
+        SELECT *, CASE WHEN creation_date ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}$'
+                       THEN left(creation_date, %s) ELSE creation_date END AS bucket
+        FROM invoices WHERE user_id=%s
+    ) i
+    GROUP BY bucket
+    ORDER BY bucket DESC NULLS LAST
+    """, (CATEGORIZE_PERIODS[period], user_id))
+    return {r["bucket"]: r["invoices"] for r in cur.fetchall()}
+
+def get_invoice_stamp(cur, user_id):
+    """Return a (max id, count, last update) stamp that changes on every write to a user's invoices"""
+    # Creates raise MAX(id), deletes lower COUNT(*), and edits bump updated_at via trigger,
+    # so cached results are never served stale, whichever process handled the write
+    execute_prepared(cur, "invoice_stamp_q", (user_id,))
+    result = cur.fetchone()
+    return (result["max_id"], result["n"], result["updated"]) if result else None
+
 @app.route("/api/invoices/categorize")
 @login_required
 def categorize():
     period = request.args.get("period", "month")
+    if period not in CATEGORIZE_PERIODS:
+        period = "month"
     db = get_db()
     cur = db.cursor()
-    cur.execute("SELECT * FROM invoices WHERE user_id=%s", (current_user.id,))
-    invoices = [row_to_invoice(dict(r)) for r in cur.fetchall()]
-    
-    # Attach customers to each invoice (without items for this view)
-    for inv in invoices:
-        cur.execute("SELECT name FROM customers WHERE invoice_id=%s", (inv["id"],))
-        customers = [{"name": c["name"]} for c in cur.fetchall()]
-        inv["customers"] = customers
-    
-    categorized = {}
-    for inv in invoices:
-        try:
-            d = datetime.strptime(inv["creation_date"], "%Y-%m-%d")
-        except:
-            # fallback: keep as-is
-            key = inv["creation_date"]
-        else:
-            if period == "year":
-                key = str(d.year)
-            elif period == "day":
-                key = d.strftime("%Y-%m-%d")
-            else:
-                key = d.strftime("%Y-%m")
-        categorized.setdefault(key, []).append(inv)
-    return jsonify(categorized)
+    stamp = get_invoice_stamp(cur, current_user.id)
+    return jsonify(_categorize_invoices(current_user.id, period, stamp))
 
 @app.route("/api/invoices/reset", methods=["POST"])
 @login_required
@@ -552,11 +916,16 @@ def reset_invoice_number():
     """Reset invoice counter (doesn't actually delete data, just returns current max)"""
     db = get_db()
     cur = db.cursor()
-    cur.execute("SELECT MAX(invoice_number) as mx FROM invoices WHERE user_id=%s", (current_user.id,))
+    execute_prepared(cur, "max_invoice_number_q", (current_user.id,))
     result = cur.fetchone()
     mx = result["mx"] if result and result["mx"] else 999
     return jsonify({"success": True, "lastInvoiceNumber": mx})
 
+# Rendered PDFs are cached by row version, so stale entries are never served
+PDF_CACHE_TIMEOUT = 24 * 60 * 60
+# Bump whenever render_invoice_pdf output changes, so ETags and cached bytes roll over
+PDF_RENDER_VERSION = 1
+
 @app.route("/api/invoices/<int:invoice_number>/pdf", methods=["GET"])
 @login_required
 def generate_pdf(invoice_number):
@@ -570,24 +939,35 @@ def generate_pdf(invoice_number):
     if not row:
         return jsonify({"error": "Invoice not found"}), 404
     
-    invoice = row_to_invoice(dict(row))
-    
-    # Fetch customers and items
-    cur.execute("SELECT * FROM customers WHERE invoice_id=%s", (invoice["id"],))
-    customers = []
-    for c in cur.fetchall():
-        c_dict = dict(c)
-        cur.execute("SELECT description, quantity, unit_price FROM items WHERE customer_id=%s", (c_dict["id"],))
-        items = [dict(x) for x in cur.fetchall()]
-        customers.append({
-            "name": c_dict["name"],
-            "address": c_dict["address"],
-            "email": c_dict["email"],
-            "items": items
-        })
-    
-    invoice["customers"] = customers
+    # The invoice row version identifies the rendered PDF
+    etag = hashlib.sha1(f"{PDF_RENDER_VERSION}:{row['id']}:{row['updated_at']}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    pdf_bytes = cache.get(f"invoice_pdf:{etag}")
+    if pdf_bytes is None:
+        invoice = row_to_invoice(row)
+
+        # Fetch customers and items
+        attach_customers(db, [invoice])
 
+        pdf_bytes = render_invoice_pdf(invoice)
+        cache.set(f"invoice_pdf:{etag}", pdf_bytes, timeout=PDF_CACHE_TIMEOUT)
+
+    response = send_file(
+        BytesIO(pdf_bytes),
+        as_attachment=False,
+        download_name=f"invoice_{invoice_number}.pdf",
+        mimetype="application/pdf",
+        etag=etag
+    )
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def render_invoice_pdf(invoice):
+    """Render an invoice dictionary (with customers and items) to PDF bytes"""
     # ---- PDF Generation with fpdf2 ----
     pdf = FPDF()
     pdf.add_page()
@@ -641,17 +1021,9 @@ def generate_pdf(invoice_number):
 
         # Items Table
         if cust.get('items'):
-            # Table header
-            pdf.set_fill_color(230, 230, 230)
-            pdf.set_font("Arial", "B", 9)
-            pdf.cell(90, 6, "Description", 1, 0, "L", 1)
-            pdf.cell(20, 6, "Qty", 1, 0, "C", 1)
-            pdf.cell(30, 6, "Unit Price", 1, 0, "R", 1)
-            pdf.cell(30, 6, "Total", 1, 1, "R", 1)
-
-            pdf.set_font("Arial", "", 9)
+            # Pre-format every row, then render the table in one pass
+            rows = [("Description", "Qty", "Unit Price", "Total")]
             subtotal = 0
-
             for item in cust['items']:
                 qty = item.get('quantity', 0)
                 unit_price = item.get('unit_price', 0)
@@ -661,13 +1033,21 @@ def generate_pdf(invoice_number):
                 desc = item.get('description', '')
                 if len(desc) > 45:
                     desc = desc[:42] + "..."
+                rows.append((desc, str(qty), f"${unit_price:.2f}", f"${total:.2f}"))
 
-                # Alternate row background
-                pdf.set_fill_color(250, 250, 250)
-                pdf.cell(90, 6, desc, 1, 0, "L", 1)
-                pdf.cell(20, 6, str(qty), 1, 0, "C", 1)
-                pdf.cell(30, 6, f"${unit_price:.2f}", 1, 0, "R", 1)
-                pdf.cell(30, 6, f"${total:.2f}", 1, 1, "R", 1)
+            pdf.set_font("Arial", "", 9)
+            with pdf.table(
+                rows,
+                width=170,
+                col_widths=(90, 20, 30, 30),
+                text_align=("LEFT", "CENTER", "RIGHT", "RIGHT"),
+                align="LEFT",
+                line_height=6,
+                headings_style=FontFace(emphasis="BOLD", fill_color=(230, 230, 230)),
+                cell_fill_color=(250, 250, 250),
+                cell_fill_mode="ALL",
+            ):
+                pass
 
             # Subtotal for this customer
             pdf.set_font("Arial", "B", 10)
@@ -696,22 +1076,20 @@ def generate_pdf(invoice_number):
     pdf.set_font("Arial", "", 8)
     pdf.cell(0, 10, "Thank you for your business!", 0, 0, "C")
 
-    # Output PDF to buffer
-    buffer = BytesIO()
-    buffer.write(pdf.output())
-    buffer.seek(0)
+    # fpdf2 always assembles the whole document into an in-memory bytearray (pdf.buffer),
+    # even when output() is given a file object, so the PDF cannot be streamed as it is
+    # generated. bytes() is the one copy; BytesIO and the cache reuse it.
+    return bytes(pdf.output())
 
-    return send_file(
-        buffer,
-        as_attachment=False,
-        download_name=f"invoice_{invoice_number}.pdf",
-        mimetype="application/pdf"
-    )
+@app.cli.command("init-db")
+def init_db_command():
+    """Run all database migrations (flask --app app init-db)"""
+    init_db(force=True)
 
-# Initialize database on startup
+# Initialize database on startup (RUN_MIGRATIONS=1 forces the full migration)
 try:
     with app.app_context():
-        init_db()
+        init_db(force=os.environ.get("RUN_MIGRATIONS") == "1")
         logger.info("Application initialized successfully")
 except Exception as e:
     logger.error(f"Database initialization failed: {e}")
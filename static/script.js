@@ -188,18 +188,13 @@ function collectInvoiceData() {
         return null;
     }
 
-    const total_amount = customers.reduce((sum, c) =>
-        sum + c.items.reduce((s, i) => s + (i.quantity * i.unit_price), 0), 0
-    );
-
     return {
         invoice_number: invoiceNumber ? parseInt(invoiceNumber) : null,
         company_name: company.name,
         company_address: company.address,
         company_email: company.email,
         creation_date: invoiceDate,
-        customers: customers,
-        total_amount: total_amount
+        customers: customers
     };
 }
 